@@ -3,14 +3,22 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from fastapi.requests import Request
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 import os
 import json
-from typing import List, Optional
+from typing import Dict, List, Optional
 import asyncio
 from datetime import datetime
-import uuid
 
-from models import ExamSession, Topic, Question, User
+from sqlalchemy import insert, select
+
+try:
+    import fitz  # PyMuPDF
+    _HAS_FITZ = True
+except ImportError:
+    _HAS_FITZ = False
+
+from models import ExamSession, Topic, Question, User, generate_id
 from services.gemini_service import GeminiService
 from services.gpt_service import GPTService
 from services.priority_queue import PriorityQueueService
@@ -22,12 +30,46 @@ app = FastAPI(title="LAST MINUTE Exam Prep AI", version="1.0.0")
 
 # Determine absolute paths for static files and templates
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+
+# Static assets rarely change, so let browsers cache them instead of revalidating
+STATIC_CACHE_MAX_AGE = 86400
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that sends a Cache-Control header with every file"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", f"public, max-age={STATIC_CACHE_MAX_AGE}")
+        return response
+
 app.mount(
     "/static",
-    StaticFiles(directory=os.path.join(BASE_DIR, "static")),
+    CachedStaticFiles(directory=os.path.join(BASE_DIR, "static")),
     name="static",
 )
-templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+# Compile templates once; only re-check them on disk while debugging
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader(os.path.join(BASE_DIR, "templates")),
+        autoescape=select_autoescape(),
+        auto_reload=DEBUG,
+        cache_size=400,
+        bytecode_cache=FileSystemBytecodeCache(),
+    )
+)
+
+# Content types accepted for practice work uploads
+VALID_PRACTICE_TYPES = frozenset({
+    "application/pdf",  # PDF files
+    "image/png",        # PNG images
+    "image/jpeg",       # JPEG images
+    "image/jpg",        # JPG images
+    "image/gif",        # GIF images
+    "image/bmp",        # BMP images
+    "image/webp",       # WebP images
+    "image/tiff",       # TIFF images
+})
 
 # Initialize services
 transcription_service = GeminiService()
@@ -35,8 +77,32 @@ gpt_service = GPTService()
 priority_queue = PriorityQueueService()
 file_processor = FileProcessor()
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+def get_transcription_service() -> GeminiService:
+    """Shared transcription client for request handlers"""
+    return transcription_service
+
+def get_gpt_service() -> GPTService:
+    """Shared GPT client for request handlers"""
+    return gpt_service
+
+@app.on_event("startup")
+async def create_tables():
+    """Create database tables"""
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+
+def _create_missing_indexes(connection):
+    """Add model indexes to tables created before the index was declared"""
+    # create_all skips tables that already exist, indexes included
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+@app.on_event("shutdown")
+async def close_clients():
+    """Release pooled API connections"""
+    await gpt_service.aclose()
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -50,7 +116,7 @@ async def start_exam(
     db = Depends(get_db)
 ):
     """Start a new exam session"""
-    session_id = str(uuid.uuid4())
+    session_id = generate_id()
     session = ExamSession(
         id=session_id,
         course_name=course_name,
@@ -58,7 +124,7 @@ async def start_exam(
         created_at=datetime.utcnow()
     )
     db.add(session)
-    db.commit()
+    await db.commit()
     return {"session_id": session_id, "message": "Exam session started!"}
 
 @app.post("/upload-materials")
@@ -73,24 +139,27 @@ async def upload_materials(
 ):
     """Upload course materials for AI analysis"""
     try:
-        # Process uploaded files
-        materials = {}
-        if textbook:
-            materials["textbook"] = await file_processor.process_file(textbook, "textbook")
-        if slides:
-            materials["slides"] = await file_processor.process_file(slides, "slides")
-        if homework:
-            materials["homework"] = await file_processor.process_file(homework, "homework")
-        if past_exams:
-            materials["past_exams"] = await file_processor.process_file(past_exams, "past_exams")
-        if syllabus:
-            materials["syllabus"] = await file_processor.process_file(syllabus, "syllabus")
+        # Process uploaded files concurrently
+        uploads = {
+            "textbook": textbook,
+            "slides": slides,
+            "homework": homework,
+            "past_exams": past_exams,
+            "syllabus": syllabus,
+        }
+        uploads = {file_type: file for file_type, file in uploads.items() if file}
+        for file in uploads.values():
+            _normalize_content_type(file)
+        processed = await asyncio.gather(
+            *(file_processor.process_file(file, file_type) for file_type, file in uploads.items())
+        )
+        materials = dict(zip(uploads.keys(), processed))
         
         # Store materials in database
-        session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
+        session = await db.get(ExamSession, session_id)
         if session:
             session.materials = materials
-            db.commit()
+            await db.commit()
         
         return {"message": "Materials uploaded successfully!", "materials": list(materials.keys())}
     except Exception as e:
@@ -100,51 +169,64 @@ async def upload_materials(
 async def upload_practice_work(
     session_id: str = Form(...),
     work_files: List[UploadFile] = File(...),
-    db = Depends(get_db)
+    db = Depends(get_db),
+    transcription: GeminiService = Depends(get_transcription_service),
+    gpt: GPTService = Depends(get_gpt_service)
 ):
     """Upload practice work files (PDF, images, handwritten work) for AI analysis"""
     try:
-        results = []
+        # Validate every file before starting any extraction work
         for work_file in work_files:
-            # Validate file type
+            _normalize_content_type(work_file)
             if not _is_valid_practice_file(work_file):
                 raise HTTPException(
                     status_code=400, 
                     detail=f"Unsupported file type: {work_file.content_type}. Supported: PDF, PNG, JPG, JPEG, GIF, BMP"
                 )
-            
-            # Process file based on type
-            if work_file.content_type == "application/pdf":
-                # Handle PDF files
-                extracted_text = await _process_pdf_file(work_file)
-            else:
-                # Handle image files (PNG, JPG, etc.)
-                extracted_text = await transcription_service.transcribe_work(work_file)
-
-            # Analyze correctness using GPT
-            analysis = await gpt_service.analyze_work(extracted_text)
-            # TODO: Extend reasoning or feedback logic here
-
+        
+        # Transcribe multi-image uploads as a single Gemini batch job when enabled
+        transcripts: Dict[int, str] = {}
+        image_indexes = [i for i, work_file in enumerate(work_files) if work_file.content_type != "application/pdf"]
+        if transcription.batch_mode and len(image_indexes) > 1:
+            texts = await transcription.transcribe_batch([work_files[i] for i in image_indexes])
+            transcripts = dict(zip(image_indexes, texts))
+        
+        # Extract and analyze all files concurrently
+        extracted_texts = await asyncio.gather(*(
+            _extract_practice_text(transcription, work_file, transcripts.get(i))
+            for i, work_file in enumerate(work_files)
+        ))
+        
+        # Analyze correctness using GPT, several submissions per request
+        analyses = await gpt.analyze_work_batch([(text, "") for text in extracted_texts])
+        # TODO: Extend reasoning or feedback logic here
+        
+        results = []
+        questions = []
+        for work_file, extracted_text, analysis in zip(work_files, extracted_texts, analyses):
             # Store question and analysis
-            question = Question(
-                session_id=session_id,
-                extracted_text=extracted_text,
-                is_correct=analysis["is_correct"],
-                feedback=analysis["feedback"],
-                topics=analysis["topics"],
-                confidence=analysis["confidence"]
-            )
-            db.add(question)
+            question = {
+                "id": generate_id(),
+                "session_id": session_id,
+                "extracted_text": extracted_text,
+                "is_correct": analysis["is_correct"],
+                "feedback": analysis["feedback"],
+                "topics": analysis["topics"],
+                "confidence": analysis["confidence"]
+            }
+            questions.append(question)
             
             results.append({
-                "question_id": question.id,
+                "question_id": question["id"],
                 "filename": work_file.filename,
                 "file_type": work_file.content_type,
                 "extracted_text": extracted_text,
                 "analysis": analysis
             })
         
-        db.commit()
+        if questions:
+            await db.execute(insert(Question), questions)
+        await db.commit()
         
         # Update priority queue based on results
         await priority_queue.update_priorities(session_id, results)
@@ -153,44 +235,56 @@ async def upload_practice_work(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+async def _extract_practice_text(
+    transcription: GeminiService,
+    work_file: UploadFile,
+    extracted_text: Optional[str] = None
+) -> str:
+    """Extract text from a single practice work file, unless already transcribed"""
+    # Process file based on type, unless it was already transcribed in a batch job
+    if extracted_text is None:
+        if work_file.content_type == "application/pdf":
+            # Handle PDF files
+            extracted_text = await _process_pdf_file(work_file)
+        else:
+            # Handle image files (PNG, JPG, etc.)
+            extracted_text = await transcription.transcribe_work(work_file)
+
+    return extracted_text
+
 def _is_valid_practice_file(file: UploadFile) -> bool:
     """Check if uploaded file is a valid practice work format"""
-    valid_types = [
-        "application/pdf",  # PDF files
-        "image/png",        # PNG images
-        "image/jpeg",       # JPEG images
-        "image/jpg",        # JPG images
-        "image/gif",        # GIF images
-        "image/bmp",        # BMP images
-        "image/webp",       # WebP images
-        "image/tiff",       # TIFF images
-    ]
-    return file.content_type in valid_types
+    return file.content_type in VALID_PRACTICE_TYPES
+
+def _normalize_content_type(file: UploadFile) -> None:
+    """Lower-case an upload's content type in place so every later consumer sees the same value"""
+    headers = file.headers.mutablecopy()
+    headers["content-type"] = (file.content_type or "").lower()
+    file.headers = headers
 
 async def _process_pdf_file(pdf_file: UploadFile) -> str:
     """Extract text from PDF files"""
+    if not _HAS_FITZ:
+        # Fallback if PyMuPDF is not available
+        return f"PDF file uploaded: {pdf_file.filename} (PDF processing not available)"
+    
     try:
-        # For now, we'll use a simple approach
-        # In production, you might want to use PyPDF2 or pdfplumber for better extraction
-        import PyPDF2
-        import io
-        
-        # Read PDF content
+        # Read PDF content and parse it off the event loop
         pdf_content = await pdf_file.read()
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_content))
-        
-        # Extract text from all pages
-        extracted_text = ""
-        for page in pdf_reader.pages:
-            extracted_text += page.extract_text() + "\n"
-        
-        return extracted_text.strip()
-    except ImportError:
-        # Fallback if PyPDF2 is not available
-        return f"PDF file uploaded: {pdf_file.filename} (PDF processing not available)"
+        return await asyncio.to_thread(_extract_pdf_text, pdf_content)
     except Exception as e:
         return f"Error processing PDF: {str(e)}"
 
+def _extract_pdf_text(pdf_content: bytes) -> str:
+    """Extract text from all pages of an in-memory PDF"""
+    doc = fitz.open(stream=pdf_content, filetype="pdf")
+    try:
+        extracted_text = "\n".join(page.get_text() for page in doc.pages())
+    finally:
+        doc.close()
+
+    return extracted_text.strip()
+
 @app.get("/get-priority-queue/{session_id}")
 async def get_priority_queue(session_id: str, db = Depends(get_db)):
     """Get prioritized topics for study focus"""
@@ -203,11 +297,12 @@ async def get_priority_queue(session_id: str, db = Depends(get_db)):
 @app.get("/session/{session_id}")
 async def get_session_summary(session_id: str, request: Request, db = Depends(get_db)):
     """Get comprehensive session summary"""
-    session = db.query(ExamSession).filter(ExamSession.id == session_id).first()
+    session = await db.get(ExamSession, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    questions = db.query(Question).filter(Question.session_id == session_id).all()
+    result = await db.execute(select(Question).where(Question.session_id == session_id))
+    questions = result.scalars().all()
     priorities = await priority_queue.get_priorities(session_id)
     
     return templates.TemplateResponse("session.html", {
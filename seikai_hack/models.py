@@ -2,9 +2,14 @@ from sqlalchemy import Column, String, DateTime, Boolean, Float, Text, ForeignKe
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from ulid import ULID
 
 Base = declarative_base()
 
+def generate_id() -> str:
+    """Time-ordered primary key (ULID), so new rows append to the end of the index"""
+    return str(ULID())
+
 class User(Base):
     __tablename__ = "users"
     
@@ -18,8 +23,8 @@ class User(Base):
 class ExamSession(Base):
     __tablename__ = "exam_sessions"
     
-    id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"))
+    id = Column(String, primary_key=True, default=generate_id)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
     course_name = Column(String, nullable=False)
     exam_date = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -32,8 +37,8 @@ class ExamSession(Base):
 class Question(Base):
     __tablename__ = "questions"
     
-    id = Column(String, primary_key=True)
-    session_id = Column(String, ForeignKey("exam_sessions.id"))
+    id = Column(String, primary_key=True, default=generate_id)
+    session_id = Column(String, ForeignKey("exam_sessions.id"), index=True)
     extracted_text = Column(Text, nullable=False)
     is_correct = Column(Boolean, nullable=False)
     feedback = Column(Text)
@@ -46,8 +51,8 @@ class Question(Base):
 class Topic(Base):
     __tablename__ = "topics"
     
-    id = Column(String, primary_key=True)
-    session_id = Column(String, ForeignKey("exam_sessions.id"))
+    id = Column(String, primary_key=True, default=generate_id)
+    session_id = Column(String, ForeignKey("exam_sessions.id"), index=True)
     name = Column(String, nullable=False)
     priority_score = Column(Float, default=1.0)
     questions_attempted = Column(Integer, default=0)
@@ -15,6 +15,8 @@ def main():
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
     debug = os.getenv("DEBUG", "false").lower() == "true"
+    # Priority queues live in process memory, so only scale out once they are persisted
+    workers = int(os.getenv("WORKERS", 1))
     
     print("🚨 LAST MINUTE Exam Prep AI 🚨")
     print("=" * 40)
@@ -23,7 +25,7 @@ def main():
     print("=" * 40)
     
     # Check for required API keys
-    required_keys = ["OPENAI_API_KEY", "MATHPIX_APP_ID", "MATHPIX_APP_KEY"]
+    required_keys = ["OPENAI_API_KEY", "GEMINI_API_KEY"]
     missing_keys = [key for key in required_keys if not os.getenv(key)]
     
     if missing_keys:
@@ -35,11 +37,16 @@ def main():
         print("\nStarting in demo mode (some features may not work)")
     
     # Start the server
+    # "auto" picks uvloop and httptools (installed via uvicorn[standard]) when available
     uvicorn.run(
         "app:app",
         host=host,
         port=port,
         reload=debug,
+        workers=None if debug else workers,
+        loop="auto",
+        http="auto",
+        access_log=debug,
         log_level="info"
     )
 
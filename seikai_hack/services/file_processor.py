@@ -1,10 +1,49 @@
 import os
+import ast
+import shutil
+import json
+import time
+import asyncio
 import aiofiles
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from fastapi import UploadFile
 import uuid
 from datetime import datetime
 
+# Optional parsers: without them uploads are still stored, just with less metadata
+try:
+    import fitz  # PyMuPDF
+    _HAS_FITZ = True
+except ImportError:
+    _HAS_FITZ = False
+
+try:
+    from PIL import Image, UnidentifiedImageError
+    _HAS_PIL = True
+except ImportError:
+    _HAS_PIL = False
+
+# Poppler's pdftotext, used for full-document extraction when installed
+_PDFTOTEXT = shutil.which("pdftotext")
+
+# Uploads are copied to disk in chunks of this size instead of being read whole
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Practice PDF previews only look at the first few pages
+SAMPLE_PAGES = 3
+SAMPLE_CHARS_PER_PAGE = 500
+
+# Pillow format names for the accepted image content types, so only one decoder is probed
+IMAGE_FORMATS = {
+    "image/png": "PNG",
+    "image/jpeg": "JPEG",
+    "image/jpg": "JPEG",
+    "image/gif": "GIF",
+    "image/bmp": "BMP",
+    "image/webp": "WEBP",
+    "image/tiff": "TIFF",
+}
+
 class FileProcessor:
     def __init__(self):
         self.upload_dir = "uploads"
@@ -14,8 +53,7 @@ class FileProcessor:
     def _ensure_directories(self):
         """Ensure upload and processed directories exist"""
         for directory in [self.upload_dir, self.processed_dir]:
-            if not os.path.exists(directory):
-                os.makedirs(directory)
+            os.makedirs(directory, exist_ok=True)
     
     async def process_file(self, file: UploadFile, file_type: str) -> Dict[str, Any]:
         """Process uploaded file and extract relevant information"""
@@ -27,17 +65,15 @@ class FileProcessor:
             
             # Save file
             file_path = os.path.join(self.upload_dir, filename)
-            async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+            file_size = await self._save_upload(file, file_path)
             
             # Process based on file type
-            processed_info = await self._extract_file_info(file_path, file_type, content)
+            processed_info = await self._extract_file_info(file_path, file_type, file_size)
             
             # Store processed information
             processed_path = os.path.join(self.processed_dir, f"{file_id}.json")
             async with aiofiles.open(processed_path, 'w') as f:
-                await f.write(str(processed_info))
+                await f.write(json.dumps(processed_info))
             
             return {
                 "file_id": file_id,
@@ -47,92 +83,129 @@ class FileProcessor:
                 "processed_path": processed_path,
                 "content_summary": processed_info.get("summary", ""),
                 "uploaded_at": datetime.utcnow().isoformat(),
-                "file_size": len(content)
+                "file_size": file_size
             }
             
         except Exception as e:
             raise Exception(f"File processing failed: {str(e)}")
     
-    async def _extract_file_info(self, file_path: str, file_type: str, content: bytes) -> Dict[str, Any]:
+    async def _save_upload(self, file: UploadFile, file_path: str) -> int:
+        """Stream an upload to disk in chunks and return its size in bytes"""
+        file_size = 0
+        async with aiofiles.open(file_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                file_size += len(chunk)
+        return file_size
+    
+    async def _extract_file_info(self, file_path: str, file_type: str, file_size: int) -> Dict[str, Any]:
         """Extract relevant information from different file types"""
         try:
             if file_type == "textbook":
-                return await self._process_textbook(file_path, content)
+                return await self._process_textbook(file_path, file_size)
             elif file_type == "slides":
-                return await self._process_slides(file_path, content)
+                return await self._process_slides(file_path, file_size)
             elif file_type == "homework":
-                return await self._process_homework(file_path, content)
+                return await self._process_homework(file_path, file_size)
             elif file_type == "past_exams":
-                return await self._process_past_exams(file_path, content)
+                return await self._process_past_exams(file_path, file_size)
             elif file_type == "syllabus":
-                return await self._process_syllabus(file_path, content)
+                return await self._process_syllabus(file_path, file_size)
             else:
-                return await self._process_generic(file_path, content)
+                return await self._process_generic(file_path, file_size)
                 
         except Exception as e:
             return {
                 "error": f"Failed to process {file_type}: {str(e)}",
-                "summary": f"File type: {file_type}, Size: {len(content)} bytes"
+                "summary": f"File type: {file_type}, Size: {file_size} bytes"
             }
     
-    async def _process_textbook(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_textbook(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process textbook files"""
-        # In a real implementation, this would use OCR or PDF parsing
-        # For now, return basic info
         return {
             "type": "textbook",
-            "summary": f"Textbook content ({len(content)} bytes)",
+            "summary": f"Textbook content ({file_size} bytes)",
+            "text": await self._extract_pdf_text(file_path),
             "chapters": [],
             "key_concepts": [],
             "difficulty_level": "intermediate"
         }
     
-    async def _process_slides(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _extract_pdf_text(self, file_path: str) -> str:
+        """Extract the full text of a saved PDF, preferring Poppler's pdftotext over PyMuPDF"""
+        if not file_path.lower().endswith(".pdf"):
+            return ""
+        
+        if _PDFTOTEXT:
+            # Runs outside the interpreter, so large documents don't hold the GIL
+            proc = await asyncio.create_subprocess_exec(
+                _PDFTOTEXT, "-layout", file_path, "-",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await proc.communicate()
+            if proc.returncode == 0:
+                return stdout.decode("utf-8", errors="replace")
+        
+        if _HAS_FITZ:
+            return await asyncio.to_thread(self._read_pdf_text, file_path)
+        return ""
+    
+    def _read_pdf_text(self, file_path: str) -> str:
+        """Extract the full text of a saved PDF with PyMuPDF"""
+        doc = fitz.open(file_path, filetype="pdf")
+        try:
+            return "\n".join(page.get_text() for page in doc.pages())
+        finally:
+            doc.close()
+    
+    async def _process_slides(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process lecture slides"""
         return {
             "type": "slides",
-            "summary": f"Lecture slides ({len(content)} bytes)",
+            "summary": f"Lecture slides ({file_size} bytes)",
             "topics": [],
             "key_points": [],
             "lecture_count": 0
         }
     
-    async def _process_homework(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_homework(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process homework assignments"""
         return {
             "type": "homework",
-            "summary": f"Homework assignment ({len(content)} bytes)",
+            "summary": f"Homework assignment ({file_size} bytes)",
             "problems": [],
             "solutions": [],
             "difficulty": "medium"
         }
     
-    async def _process_past_exams(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_past_exams(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process past exam materials"""
         return {
             "type": "past_exams",
-            "summary": f"Past exam materials ({len(content)} bytes)",
+            "summary": f"Past exam materials ({file_size} bytes)",
+            "text": await self._extract_pdf_text(file_path),
             "exam_count": 0,
             "topics_covered": [],
             "difficulty_trends": []
         }
     
-    async def _process_syllabus(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_syllabus(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process course syllabus"""
         return {
             "type": "syllabus",
-            "summary": f"Course syllabus ({len(content)} bytes)",
+            "summary": f"Course syllabus ({file_size} bytes)",
             "course_info": {},
             "learning_objectives": [],
             "assessment_methods": []
         }
     
-    async def _process_generic(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_generic(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process generic files"""
         return {
             "type": "generic",
-            "summary": f"Generic file ({len(content)} bytes)",
-            "file_size": len(content),
+            "summary": f"Generic file ({file_size} bytes)",
+            "file_size": file_size,
             "extension": self._get_file_extension(file_path)
         }
     
@@ -146,17 +219,15 @@ class FileProcessor:
             
             # Save file
             file_path = os.path.join(self.upload_dir, filename)
-            async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+            file_size = await self._save_upload(file, file_path)
             
             # Process based on content type
-            processed_info = await self._extract_practice_work_info(file_path, file.content_type, content)
+            processed_info = await self._extract_practice_work_info(file_path, file.content_type, file_size)
             
             # Store processed information
             processed_path = os.path.join(self.processed_dir, f"{file_id}.json")
             async with aiofiles.open(processed_path, 'w') as f:
-                await f.write(str(processed_info))
+                await f.write(json.dumps(processed_info))
             
             return {
                 "file_id": file_id,
@@ -167,77 +238,90 @@ class FileProcessor:
                 "processed_path": processed_path,
                 "content_summary": processed_info.get("summary", ""),
                 "uploaded_at": datetime.utcnow().isoformat(),
-                "file_size": len(content)
+                "file_size": file_size
             }
             
         except Exception as e:
             raise Exception(f"Practice work processing failed: {str(e)}")
     
-    async def _extract_practice_work_info(self, file_path: str, content_type: str, content: bytes) -> Dict[str, Any]:
+    async def _extract_practice_work_info(self, file_path: str, content_type: str, file_size: int) -> Dict[str, Any]:
         """Extract information from practice work files"""
         try:
             if content_type == "application/pdf":
-                return await self._process_practice_pdf(file_path, content)
+                return await self._process_practice_pdf(file_path, file_size)
             elif content_type.startswith("image/"):
-                return await self._process_practice_image(file_path, content, content_type)
+                return await self._process_practice_image(file_path, file_size, content_type)
             else:
-                return await self._process_generic(file_path, content)
+                return await self._process_generic(file_path, file_size)
                 
         except Exception as e:
             return {
                 "error": f"Failed to process practice work: {str(e)}",
                 "content_type": content_type,
-                "summary": f"Practice work file ({len(content)} bytes)"
+                "summary": f"Practice work file ({file_size} bytes)"
             }
     
-    async def _process_practice_pdf(self, file_path: str, content: bytes) -> Dict[str, Any]:
+    async def _process_practice_pdf(self, file_path: str, file_size: int) -> Dict[str, Any]:
         """Process practice work PDF files"""
+        if not _HAS_FITZ:
+            return {
+                "type": "practice_work_pdf",
+                "summary": f"Practice work PDF ({file_size} bytes) - PDF processing not available",
+                "file_size": file_size,
+                "note": "Install PyMuPDF for better PDF processing"
+            }
+        
         try:
-            import PyPDF2
-            import io
-            
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            page_count = len(pdf_reader.pages)
-            
-            # Extract text from first few pages for summary
-            sample_text = ""
-            for i in range(min(3, page_count)):
-                sample_text += pdf_reader.pages[i].extract_text()[:500] + " "
+            page_count, sample_text = await asyncio.to_thread(self._read_pdf_sample, file_path)
             
             return {
                 "type": "practice_work_pdf",
                 "summary": f"Practice work PDF with {page_count} pages",
                 "page_count": page_count,
                 "sample_text": sample_text.strip(),
-                "file_size": len(content),
+                "file_size": file_size,
                 "estimated_questions": max(1, page_count // 2)  # Rough estimate
             }
-        except ImportError:
-            return {
-                "type": "practice_work_pdf",
-                "summary": f"Practice work PDF ({len(content)} bytes) - PDF processing not available",
-                "file_size": len(content),
-                "note": "Install PyPDF2 for better PDF processing"
-            }
         except Exception as e:
             return {
                 "type": "practice_work_pdf",
-                "summary": f"Practice work PDF ({len(content)} bytes)",
+                "summary": f"Practice work PDF ({file_size} bytes)",
                 "error": str(e),
-                "file_size": len(content)
+                "file_size": file_size
             }
     
-    async def _process_practice_image(self, file_path: str, content: bytes, content_type: str) -> Dict[str, Any]:
-        """Process practice work image files"""
+    def _read_pdf_sample(self, file_path: str) -> Tuple[int, str]:
+        """Return the page count and a short text sample from the first few pages"""
+        doc = fitz.open(file_path, filetype="pdf")
         try:
-            from PIL import Image
-            import io
+            page_count = doc.page_count
             
+            # Extract text from first few pages for summary; other pages are never loaded
+            sample_text = " ".join(
+                doc.load_page(i).get_text()[:SAMPLE_CHARS_PER_PAGE]
+                for i in range(min(SAMPLE_PAGES, page_count))
+            )
+        finally:
+            doc.close()
+
+        return page_count, sample_text
+    
+    async def _process_practice_image(self, file_path: str, file_size: int, content_type: str) -> Dict[str, Any]:
+        """Process practice work image files"""
+        if not _HAS_PIL:
+            return {
+                "type": "practice_work_image",
+                "summary": f"Practice work image ({file_size} bytes)",
+                "content_type": content_type,
+                "file_size": file_size,
+                "note": "Install Pillow for better image processing"
+            }
+        
+        try:
             # Open image to get metadata
-            image = Image.open(io.BytesIO(content))
-            width, height = image.size
-            format_name = image.format
-            mode = image.mode
+            width, height, format_name, mode = await asyncio.to_thread(
+                self._read_image_metadata, file_path, content_type
+            )
             
             return {
                 "type": "practice_work_image",
@@ -245,27 +329,32 @@ class FileProcessor:
                 "dimensions": {"width": width, "height": height},
                 "format": format_name,
                 "color_mode": mode,
-                "file_size": len(content),
+                "file_size": file_size,
                 "content_type": content_type,
                 "estimated_questions": 1  # Single image typically contains one question
             }
-        except ImportError:
-            return {
-                "type": "practice_work_image",
-                "summary": f"Practice work image ({len(content)} bytes)",
-                "content_type": content_type,
-                "file_size": len(content),
-                "note": "Install Pillow for better image processing"
-            }
         except Exception as e:
             return {
                 "type": "practice_work_image",
-                "summary": f"Practice work image ({len(content)} bytes)",
+                "summary": f"Practice work image ({file_size} bytes)",
                 "content_type": content_type,
                 "error": str(e),
-                "file_size": len(content)
+                "file_size": file_size
             }
     
+    def _read_image_metadata(self, file_path: str, content_type: str) -> Tuple[int, int, str, str]:
+        """Return width, height, format and color mode of a saved image (header only, no decode)"""
+        image_format = IMAGE_FORMATS.get(content_type)
+        try:
+            image = Image.open(file_path, formats=[image_format] if image_format else None)
+        except UnidentifiedImageError:
+            # Content type didn't match the actual data; let Pillow probe every format
+            image = Image.open(file_path)
+        
+        with image:
+            width, height = image.size
+            return width, height, image.format, image.mode
+    
     def _get_file_extension(self, filename: str) -> str:
         """Get file extension from filename"""
         if filename and '.' in filename:
@@ -275,19 +364,25 @@ class FileProcessor:
     async def cleanup_old_files(self, max_age_hours: int = 24):
         """Clean up old uploaded files"""
         try:
-            current_time = datetime.utcnow()
-            for directory in [self.upload_dir, self.processed_dir]:
-                if os.path.exists(directory):
-                    for filename in os.listdir(directory):
-                        file_path = os.path.join(directory, filename)
-                        file_age = current_time - datetime.fromtimestamp(os.path.getctime(file_path))
-                        
-                        if file_age.total_seconds() > max_age_hours * 3600:
-                            os.remove(file_path)
-                            
+            await asyncio.to_thread(self._cleanup_sync, max_age_hours)
         except Exception as e:
             print(f"Cleanup failed: {str(e)}")
     
+    def _cleanup_sync(self, max_age_hours: int):
+        """Remove files older than max_age_hours from the upload and processed directories"""
+        cutoff = time.time() - max_age_hours * 3600
+        for directory in [self.upload_dir, self.processed_dir]:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and entry.stat().st_ctime < cutoff:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        # Removed by someone else since the directory was listed
+                        continue
+    
     async def get_file_summary(self, file_id: str) -> Optional[Dict[str, Any]]:
         """Get summary of processed file"""
         try:
@@ -295,7 +390,11 @@ class FileProcessor:
             if os.path.exists(processed_path):
                 async with aiofiles.open(processed_path, 'r') as f:
                     content = await f.read()
-                    return eval(content)  # In production, use proper JSON parsing
+                try:
+                    return json.loads(content)
+                except json.JSONDecodeError:
+                    # Files written before summaries were stored as JSON hold a dict repr
+                    return ast.literal_eval(content)
             return None
         except Exception:
             return None
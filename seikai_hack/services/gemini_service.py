@@ -1,8 +1,15 @@
+import io
 import os
-import tempfile
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+import httpx
 from fastapi import UploadFile
 
 from google import genai
+from google.genai import types
 
 
 SYSTEM_PROMPT = """
@@ -67,6 +74,81 @@ Your job: read the student's work from all provided images, follow these rules e
 """
 
 
+# Keep well inside the Gemini quota: a few requests in flight and 80% of the 30 RPM limit
+MAX_CONCURRENT_REQUESTS = 5
+REQUESTS_PER_MINUTE = 24
+
+# The SDK keeps one httpx client per GeminiService; size its keep-alive pool for fan-out
+REQUEST_TIMEOUT_MS = 60_000
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+# Batch Mode jobs are polled until they reach one of these terminal states; a job still
+# queued after BATCH_MAX_WAIT seconds is cancelled and its files transcribed one by one
+BATCH_POLL_INTERVAL = 10
+BATCH_MAX_WAIT = 300
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+# Re-uploads of the same image within this window reuse the earlier transcript
+TRANSCRIPT_CACHE_TTL = 600
+TRANSCRIPT_CACHE_SIZE = 256
+
+
+class _RateLimiter:
+    """Sliding-window limiter allowing at most ``max_calls`` per ``period`` seconds."""
+
+    def __init__(self, max_calls: int, period: float = 60.0) -> None:
+        self.max_calls = max_calls
+        self.period = period
+        self._calls: deque = deque()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        """Wait until another call fits in the current window."""
+        # Created on first use: before 3.10 asyncio primitives bind to the loop current at creation
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._calls[0]))
+
+
+class _TTLCache:
+    """Bounded LRU cache whose entries expire ``ttl`` seconds after being stored."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
 class GeminiService:
     """Service for transcribing handwritten work using Google's Gemini API."""
 
@@ -75,32 +157,114 @@ class GeminiService:
         if not api_key:
             raise ValueError("Gemini API key not found in environment variables")
 
-        self.client = genai.Client(api_key=api_key)
+        self.client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(
+                timeout=REQUEST_TIMEOUT_MS,
+                async_client_args={"limits": HTTP_LIMITS},
+            ),
+        )
         self.model = "gemini-2.5-flash"
+        self.batch_mode = os.getenv("GEMINI_BATCH_MODE", "false").lower() == "true"
+        self._transcript_cache = _TTLCache(TRANSCRIPT_CACHE_SIZE, TRANSCRIPT_CACHE_TTL)
+        self._rate_limiter = _RateLimiter(REQUESTS_PER_MINUTE)
+        self._sema: Optional[asyncio.Semaphore] = None
+
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Per-client request semaphore, created inside the running event loop."""
+        if self._sema is None:
+            self._sema = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return self._sema
 
     async def transcribe_work(self, image_file: UploadFile) -> str:
         """Upload an image/PDF and return its transcription."""
-        suffix = os.path.splitext(image_file.filename or "")[1] or ".png"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(await image_file.read())
-            tmp_path = tmp.name
-
-        try:
-            uploaded = self.client.files.upload(file_path=tmp_path)
-            response = self.client.models.generate_content(
+        content = await image_file.read()
+        cache_key = f"{image_file.content_type}:{hashlib.sha256(content).hexdigest()}"
+        cached = self._transcript_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        async with self._semaphore:
+            await self._rate_limiter.acquire()
+            uploaded = await self._upload(image_file, content)
+            response = await self.client.aio.models.generate_content(
                 model=self.model,
-                contents=[
-                    {"role": "system", "parts": [{"text": SYSTEM_PROMPT}]},
-                    {
-                        "role": "user",
-                        "parts": [
-                            {"text": "Read all pages/images and output ONLY the transcription text per the rules."},
-                            {"file_data": {"file_uri": uploaded.uri, "mime_type": uploaded.mime_type}},
-                        ],
-                    },
-                ],
+                contents=self._build_contents(uploaded),
+            )
+
+        if response.text:
+            self._transcript_cache.put(cache_key, response.text)
+        return response.text
+
+    async def transcribe_batch(self, image_files: List[UploadFile]) -> List[str]:
+        """Transcribe several images with one Batch Mode job, returning texts in input order.
+
+        Batch jobs are billed at half price but are queued by Gemini, so this trades
+        latency for cost and throughput.
+        """
+        async with self._semaphore:
+            contents = [await image_file.read() for image_file in image_files]
+            uploaded_files = await asyncio.gather(*(
+                self._upload(image_file, content) for image_file, content in zip(image_files, contents)
+            ))
+            await self._rate_limiter.acquire()
+            job = await self.client.aio.batches.create(
+                model=self.model,
+                src=[{"contents": self._build_contents(uploaded)} for uploaded in uploaded_files],
+                config={"display_name": "practice-work-transcription"},
             )
-            return response.text
-        finally:
-            os.remove(tmp_path)
 
+        deadline = time.monotonic() + BATCH_MAX_WAIT
+        while job.state.name not in BATCH_DONE_STATES:
+            if time.monotonic() >= deadline:
+                await self.client.aio.batches.cancel(name=job.name)
+                return await self._transcribe_each(image_files)
+            await asyncio.sleep(BATCH_POLL_INTERVAL)
+            job = await self.client.aio.batches.get(name=job.name)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise Exception(f"Gemini batch job {job.name} finished with state {job.state.name}")
+
+        # Responses are matched to inputs by index, so a short result can't be trusted
+        if len(job.dest.inlined_responses) != len(image_files):
+            return await self._transcribe_each(image_files)
+
+        transcripts = [
+            inlined.response.text if inlined.response is not None else None
+            for inlined in job.dest.inlined_responses
+        ]
+
+        # Requests that failed inside the batch are retried on their own
+        failed = [i for i, transcript in enumerate(transcripts) if transcript is None]
+        if failed:
+            retried = await self._transcribe_each([image_files[i] for i in failed])
+            for i, transcript in zip(failed, retried):
+                transcripts[i] = transcript
+        return transcripts
+
+    async def _transcribe_each(self, image_files: List[UploadFile]) -> List[str]:
+        """Transcribe files one request each, e.g. when a batch job can't be used."""
+        for image_file in image_files:
+            await image_file.seek(0)
+        return list(await asyncio.gather(*(self.transcribe_work(image_file) for image_file in image_files)))
+
+    async def _upload(self, image_file: UploadFile, content: bytes):
+        """Upload an already-read image/PDF to the Gemini Files API as raw bytes."""
+        return await self.client.aio.files.upload(
+            file=io.BytesIO(content),
+            config={"mime_type": image_file.content_type, "display_name": image_file.filename},
+        )
+
+    def _build_contents(self, uploaded) -> List[Dict[str, Any]]:
+        """Build the transcription request contents for an uploaded file."""
+        return [
+            {"role": "system", "parts": [{"text": SYSTEM_PROMPT}]},
+            {
+                "role": "user",
+                "parts": [
+                    {"text": "Read all pages/images and output ONLY the transcription text per the rules."},
+                    {"file_data": {"file_uri": uploaded.uri, "mime_type": uploaded.mime_type}},
+                ],
+            },
+        ]
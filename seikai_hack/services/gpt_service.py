@@ -1,8 +1,148 @@
 import os
 import json
-from typing import Dict, List, Any
+import asyncio
+import copy
+import functools
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
 
-from openai import OpenAI
+import httpx
+import openai
+import orjson
+from openai import AsyncOpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# The aiohttp transport holds up much better than httpx's under many concurrent requests
+try:
+    import httpx_aiohttp  # noqa: F401
+    from openai import DefaultAioHttpClient as _HttpClient
+except ImportError:
+    from openai import DefaultAsyncHttpxClient as _HttpClient
+
+# Cap in-flight requests so concurrent uploads stay under the API rate limits
+MAX_CONCURRENT_REQUESTS = 5
+
+# Connection pool shared by every request from this process
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+class ResponseStreamError(Exception):
+    """A streamed response reported an ``error`` or ``response.failed`` event"""
+
+# Rate limits, dropped connections, 5xx errors and failed streams are retried with jittered exponential backoff
+_retry = retry(
+    wait=wait_random_exponential(min=1, max=20),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+        ResponseStreamError,
+    )),
+    reraise=True,
+)
+
+# Submissions analyzed together in one prompt when several are uploaded at once
+ANALYSIS_BATCH_SIZE = 8
+
+# Identical submissions (ignoring whitespace) reuse the earlier result instead of a new LLM call
+RESPONSE_CACHE_SIZE = 1024
+
+# Structured output schema the model's analysis must follow, so replies decode without scraping
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_correct": {"type": "boolean"},
+        "feedback": {"type": "string"},
+        "topics": {"type": "array", "items": {"type": "string"}},
+        "confidence": {"type": "number"},
+        "suggestions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["is_correct", "feedback", "topics", "confidence", "suggestions"],
+    "additionalProperties": False,
+}
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "analyses": {
+            "type": "array",
+            "items": {
+                **ANALYSIS_SCHEMA,
+                "properties": {"id": {"type": "integer"}, **ANALYSIS_SCHEMA["properties"]},
+                "required": ["id", *ANALYSIS_SCHEMA["required"]],
+            },
+        },
+    },
+    "required": ["analyses"],
+    "additionalProperties": False,
+}
+
+def _json_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Responses API text config requesting output that matches a JSON schema"""
+    return {"format": {"type": "json_schema", "name": name, "schema": schema, "strict": True}}
+
+class _JSONObjectScanner:
+    """Tracks nesting across streamed chunks to spot where the top-level JSON value closes"""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> int:
+        """Return the index just past the closing bracket in ``chunk``, or -1 if still open"""
+        for i, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return -1
+
+class _LRUCache:
+    """Bounded in-process cache that evicts the least recently used entry"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+# Each course's materials summary is built once and shared by every question about it
+MATERIALS_SUMMARY_CACHE_SIZE = 128
+MATERIALS_EXCERPT_CHARS = 500
+
+@functools.lru_cache(maxsize=MATERIALS_SUMMARY_CACHE_SIZE)
+def _summarize_materials(materials: Tuple[Tuple[str, str], ...]) -> str:
+    """Prompt section listing an excerpt of each course material"""
+    return "\n".join(f"{key}: {excerpt}..." for key, excerpt in materials)
+
+def _cache_key(*parts: Optional[str]) -> str:
+    """Stable key for prompt inputs, insensitive to whitespace differences"""
+    # A transcription can come back as None (e.g. a blocked reply); key it like empty text
+    normalized = "\x00".join(" ".join((part or "").split()) for part in parts)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
 
 class GPTService:
     def __init__(self):
@@ -11,14 +151,35 @@ class GPTService:
             raise ValueError("OpenAI API key not found in environment variables")
 
         # NVIDIA's open models use the OpenAI-compatible API
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             base_url="https://integrate.api.nvidia.com/v1",
             api_key=self.api_key,
+            http_client=_HttpClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS),
+            max_retries=0,  # retried by _retry instead
         )
         self.model = "openai/gpt-oss-20b"
+        self._sema: Optional[asyncio.Semaphore] = None
+        self._analysis_cache = _LRUCache(RESPONSE_CACHE_SIZE)
+        self._topics_cache = _LRUCache(RESPONSE_CACHE_SIZE)
+    
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Per-client request semaphore, created inside the running event loop"""
+        if self._sema is None:
+            self._sema = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return self._sema
+    
+    async def aclose(self):
+        """Close the pooled HTTP connections held by the client"""
+        await self.client.close()
     
     async def analyze_work(self, extracted_text: str, course_context: str = "") -> Dict[str, Any]:
         """Analyze student work for correctness and provide feedback"""
+        cache_key = _cache_key(extracted_text, course_context)
+        cached = self._analysis_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
         try:
             # Create a comprehensive prompt for analysis
             prompt = f"""
@@ -46,76 +207,201 @@ class GPTService:
             }}
             """
             
-            response = self.client.responses.create(
-                model=self.model,
-                input=prompt,
-                max_output_tokens=1000,
-                temperature=0.6,
-                top_p=0.7,
-            )
+            async with self._semaphore:
+                content = await self._create_json(
+                    model=self.model,
+                    input=prompt,
+                    max_output_tokens=1000,
+                    temperature=0.6,
+                    top_p=0.7,
+                    text=_json_format("work_analysis", ANALYSIS_SCHEMA),
+                )
 
             # Parse the response
-            content = response.output_text
             try:
-                # Try to extract JSON from the response
-                if "```json" in content:
-                    json_start = content.find("```json") + 7
-                    json_end = content.find("```", json_start)
-                    json_content = content[json_start:json_end].strip()
-                else:
-                    # Look for JSON in the response
-                    json_start = content.find("{")
-                    json_end = content.rfind("}") + 1
-                    json_content = content[json_start:json_end]
-                
-                analysis = json.loads(json_content)
-                
-                # Ensure all required fields are present
-                required_fields = ["is_correct", "feedback", "topics", "confidence", "suggestions"]
-                for field in required_fields:
-                    if field not in analysis:
-                        analysis[field] = self._get_default_value(field)
-                
-                return analysis
+                analysis = self._complete_analysis(orjson.loads(content))
+                self._analysis_cache.put(cache_key, analysis)
+                return copy.deepcopy(analysis)
                 
             except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
+                # The reply was truncated (response.incomplete) before the JSON closed
                 return self._create_fallback_analysis(content)
                 
         except Exception as e:
             raise Exception(f"GPT analysis failed: {str(e)}")
     
+    async def analyze_work_batch(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Analyze several (extracted_text, course_context) submissions, sharing LLM calls between them"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        pending = []
+        for i, (extracted_text, course_context) in enumerate(items):
+            cached = self._analysis_cache.get(_cache_key(extracted_text, course_context))
+            if cached is not None:
+                results[i] = copy.deepcopy(cached)
+            else:
+                pending.append(i)
+        
+        # Split uncached submissions into prompts of at most ANALYSIS_BATCH_SIZE
+        chunks = [pending[start:start + ANALYSIS_BATCH_SIZE] for start in range(0, len(pending), ANALYSIS_BATCH_SIZE)]
+        analyzed = await asyncio.gather(*(self._analyze_chunk([items[i] for i in chunk]) for chunk in chunks))
+        for chunk, analyses in zip(chunks, analyzed):
+            for i, analysis in zip(chunk, analyses):
+                results[i] = analysis
+        
+        return results
+    
+    async def _analyze_chunk(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Analyze a group of submissions with a single LLM call"""
+        if len(items) == 1:
+            return [await self.analyze_work(*items[0])]
+        
+        try:
+            submissions = [
+                {"id": i, "work": extracted_text, "context": course_context}
+                for i, (extracted_text, course_context) in enumerate(items)
+            ]
+            prompt = f"""
+            You are an expert tutor analyzing several students' handwritten work.
+            
+            Each submission has an "id", the student's work (extracted from an image) and its course context:
+            {json.dumps(submissions, indent=2)}
+            
+            For EVERY submission, analyze the work and provide:
+            1. Is the answer correct? (true/false)
+            2. Detailed feedback explaining what's right/wrong
+            3. List of topics/concepts this question covers
+            4. Confidence level in your assessment (0.0-1.0)
+            5. Specific suggestions for improvement
+            
+            Respond in JSON format, with one entry per submission id:
+            {{
+                "analyses": [
+                    {{
+                        "id": 0,
+                        "is_correct": boolean,
+                        "feedback": "detailed explanation",
+                        "topics": ["topic1", "topic2"],
+                        "confidence": 0.95,
+                        "suggestions": ["suggestion1", "suggestion2"]
+                    }}
+                ]
+            }}
+            """
+            
+            async with self._semaphore:
+                content = await self._create_json(
+                    model=self.model,
+                    input=prompt,
+                    max_output_tokens=1000 * len(items),
+                    temperature=0.6,
+                    top_p=0.7,
+                    text=_json_format("work_analyses", BATCH_ANALYSIS_SCHEMA),
+                )
+            
+            analyses = {
+                entry["id"]: entry
+                for entry in orjson.loads(content).get("analyses", [])
+                if isinstance(entry, dict) and "id" in entry
+            }
+        except (json.JSONDecodeError, AttributeError):
+            analyses = {}
+        
+        results = []
+        for i, (extracted_text, course_context) in enumerate(items):
+            if i in analyses:
+                analysis = self._complete_analysis(analyses[i])
+                analysis.pop("id", None)
+                self._analysis_cache.put(_cache_key(extracted_text, course_context), analysis)
+                results.append(copy.deepcopy(analysis))
+            else:
+                results.append(None)
+        
+        # Anything the batched answer missed is analyzed on its own
+        missing = [i for i, analysis in enumerate(results) if analysis is None]
+        retried = await asyncio.gather(*(self.analyze_work(*items[i]) for i in missing))
+        for i, analysis in zip(missing, retried):
+            results[i] = analysis
+        
+        return results
+    
     async def identify_topics(self, question_text: str, course_materials: Dict[str, str]) -> List[str]:
         """Identify relevant topics from course materials"""
         try:
-            materials_summary = "\n".join([f"{key}: {value[:500]}..." for key, value in course_materials.items()])
+            materials_summary = _summarize_materials(tuple(sorted(
+                (key, value[:MATERIALS_EXCERPT_CHARS]) for key, value in course_materials.items()
+            )))
+            cache_key = _cache_key(question_text, materials_summary)
+            cached = self._topics_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
             
+            # The materials come first so every question for a course shares the same prompt prefix
             prompt = f"""
-            Based on the following course materials, identify the main topics/concepts that this question covers:
-            
-            Question: {question_text}
-            
             Course Materials:
             {materials_summary}
             
+            Based on the course materials above, identify the main topics/concepts that this question covers:
+            
+            Question: {question_text}
+            
             List the top 3-5 most relevant topics. Respond with just a comma-separated list.
             """
             
-            response = self.client.responses.create(
-                model=self.model,
-                input=prompt,
-                max_output_tokens=200,
-                temperature=0.2,
-                top_p=0.7,
-            )
+            async with self._semaphore:
+                response = await self._create_response(
+                    model=self.model,
+                    input=prompt,
+                    max_output_tokens=200,
+                    temperature=0.2,
+                    top_p=0.7,
+                )
 
             topics_text = response.output_text.strip()
             topics = [topic.strip() for topic in topics_text.split(",")]
-            return topics
+            self._topics_cache.put(cache_key, topics)
+            return list(topics)
             
         except Exception as e:
             return ["General Problem Solving"]
     
+    @_retry
+    async def _create_response(self, **request: Any) -> Any:
+        """Create a response, retrying transient API failures"""
+        return await self.client.responses.create(**request)
+    
+    @_retry
+    async def _create_json(self, **request: Any) -> str:
+        """Stream a JSON reply, hanging up as soon as its top-level object is complete"""
+        scanner = _JSONObjectScanner()
+        parts = []
+        stream = await self.client.responses.create(stream=True, **request)
+        try:
+            async for event in stream:
+                if event.type == "error":
+                    raise ResponseStreamError(f"{event.code}: {event.message}")
+                if event.type == "response.failed":
+                    error = event.response.error
+                    raise ResponseStreamError(f"{error.code}: {error.message}" if error else "response failed")
+                if event.type != "response.output_text.delta":
+                    # response.incomplete ends the stream with whatever text arrived
+                    continue
+                end = scanner.feed(event.delta)
+                if end >= 0:
+                    parts.append(event.delta[:end])
+                    break
+                parts.append(event.delta)
+        finally:
+            await stream.close()
+        return "".join(parts)
+    
+    def _complete_analysis(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Ensure all required fields are present"""
+        required_fields = ["is_correct", "feedback", "topics", "confidence", "suggestions"]
+        for field in required_fields:
+            if field not in analysis:
+                analysis[field] = self._get_default_value(field)
+        return analysis
+    
     def _get_default_value(self, field: str) -> Any:
         """Get default values for missing fields"""
         defaults = {
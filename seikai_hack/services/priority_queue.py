@@ -1,189 +1,271 @@
-import heapq
-from typing import List, Dict, Any
+import asyncio
+import time
+from typing import List, Dict, Any, Tuple
 from datetime import datetime, timedelta
-import uuid
+
+import numpy as np
+
+try:
+    import numba
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+from models import generate_id
+
+# Starting size of a session's topic arrays; they double whenever they fill up
+INITIAL_TOPIC_CAPACITY = 16
+
+# Study recommendations by bucket, from a success rate of 0.8 or better down to below 0.4
+STUDY_RECOMMENDATIONS = (
+    "Review briefly - you're doing well!",
+    "Practice more problems - you're on the right track",
+    "Focus on this topic - review concepts and practice",
+    "High priority - review fundamentals and practice extensively",
+)
+LOWEST_RECOMMENDATION = len(STUDY_RECOMMENDATIONS) - 1
+
+def _priority_score(base_score: float, success_rate: float, is_correct: bool, confidence: float) -> float:
+    """Calculate a topic's new priority score based on one outcome"""
+    # Adjust priority based on performance
+    if is_correct:
+        # Correct answer decreases priority (less need to study)
+        if success_rate > 0.8:
+            # High success rate - significantly decrease priority
+            new_score = base_score * 0.7
+        elif success_rate > 0.6:
+            # Moderate success rate - slightly decrease priority
+            new_score = base_score * 0.9
+        else:
+            # Low success rate - maintain priority
+            new_score = base_score
+    else:
+        # Wrong answer increases priority (more need to study)
+        if success_rate < 0.3:
+            # Low success rate - significantly increase priority
+            new_score = base_score * 1.5
+        elif success_rate < 0.6:
+            # Moderate success rate - increase priority
+            new_score = base_score * 1.2
+        else:
+            # High success rate - slight increase
+            new_score = base_score * 1.1
+    
+    # Apply confidence adjustment
+    if confidence < 0.7:
+        # Low confidence in analysis - increase priority to be safe
+        new_score *= 1.1
+    
+    # Ensure minimum priority
+    return max(new_score, 0.1)
+
+# With numba the scalar rule compiles (at import, thanks to the explicit signature) into
+# a ufunc that runs the branches natively over whole arrays; cache=True reuses the build.
+# Without it the same rule is mapped element-wise, so there is one copy of the scoring
+if _HAS_NUMBA:
+    _priority_scores_ufunc = numba.vectorize(
+        ["float64(float64, float64, boolean, float64)"], cache=True
+    )(_priority_score)
+else:
+    _priority_scores_ufunc = np.vectorize(_priority_score, otypes=[np.float64])
+
+class _SessionTopics:
+    """Columnar topic store for one session: one array per field, indexed by topic position"""
+    
+    def __init__(self):
+        self.positions: Dict[str, int] = {}  # topic_name -> position
+        self.ids: List[str] = []
+        self.names: List[str] = []
+        self.priority_score = np.ones(INITIAL_TOPIC_CAPACITY)
+        self.questions_attempted = np.zeros(INITIAL_TOPIC_CAPACITY, dtype=np.int64)
+        self.questions_correct = np.zeros(INITIAL_TOPIC_CAPACITY, dtype=np.int64)
+        self.last_practiced = np.zeros(INITIAL_TOPIC_CAPACITY)  # POSIX timestamps
+        self.success_rate = np.zeros(INITIAL_TOPIC_CAPACITY)
+        self.recommendation = np.full(INITIAL_TOPIC_CAPACITY, LOWEST_RECOMMENDATION, dtype=np.int8)
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def add(self, topic_name: str) -> int:
+        """Append a topic with default stats and return its position"""
+        position = len(self.names)
+        if position == len(self.priority_score):
+            capacity = 2 * position
+            self.priority_score = _grown(self.priority_score, capacity)
+            self.questions_attempted = _grown(self.questions_attempted, capacity)
+            self.questions_correct = _grown(self.questions_correct, capacity)
+            self.last_practiced = _grown(self.last_practiced, capacity)
+            self.success_rate = _grown(self.success_rate, capacity)
+            self.recommendation = _grown(self.recommendation, capacity)
+        
+        self.positions[topic_name] = position
+        self.ids.append(generate_id())
+        self.names.append(topic_name)
+        self.priority_score[position] = 1.0
+        self.questions_attempted[position] = 0
+        self.questions_correct[position] = 0
+        self.last_practiced[position] = time.time()
+        self.success_rate[position] = 0.0
+        self.recommendation[position] = LOWEST_RECOMMENDATION
+        return position
+
+def _grown(array: np.ndarray, capacity: int) -> np.ndarray:
+    """Copy of ``array`` extended to ``capacity`` elements"""
+    grown = np.zeros(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
 
 class PriorityQueueService:
     def __init__(self):
-        self.priority_queues = {}  # session_id -> priority queue
+        self.priority_queues = {}  # session_id -> topic positions, highest priority first
+        self._priorities_cache = {}  # session_id -> priorities with recommendations
+        self._topics_by_session = {}  # session_id -> _SessionTopics
     
     async def update_priorities(self, session_id: str, question_results: List[Dict[str, Any]]):
         """Update topic priorities based on question results"""
-        if session_id not in self.priority_queues:
-            self.priority_queues[session_id] = []
-        
-        # Process each question result
+        # Group outcomes by topic, keeping submission order within each topic
+        outcomes_by_topic: Dict[str, List[Tuple[bool, float]]] = {}
         for result in question_results:
             analysis = result.get("analysis", {})
             topics = analysis.get("topics", [])
             is_correct = analysis.get("is_correct", False)
             confidence = analysis.get("confidence", 0.5)
             
-            # Update priority for each topic
             for topic_name in topics:
-                await self._update_topic_priority(
-                    session_id, 
-                    topic_name, 
-                    is_correct, 
-                    confidence
-                )
+                outcomes_by_topic.setdefault(topic_name, []).append((is_correct, confidence))
+        
+        if outcomes_by_topic:
+            await self._update_topic_priorities(session_id, outcomes_by_topic)
         
         # Rebuild priority queue
         await self._rebuild_queue(session_id)
     
-    async def _update_topic_priority(
-        self, 
-        session_id: str, 
-        topic_name: str, 
-        is_correct: bool, 
-        confidence: float
+    async def _update_topic_priorities(
+        self,
+        session_id: str,
+        outcomes_by_topic: Dict[str, List[Tuple[bool, float]]]
     ):
-        """Update priority for a specific topic"""
-        # Find existing topic or create new one
-        topic = await self._get_or_create_topic(session_id, topic_name)
-
-        # Update topic stats first so scoring uses latest attempt
-        topic["questions_attempted"] += 1
-        if is_correct:
-            topic["questions_correct"] += 1
-
-        # Calculate new priority score using updated stats
-        new_score = self._calculate_priority_score(topic, is_correct, confidence)
-
-        # Apply updates
-        topic["priority_score"] = new_score
-        topic["last_practiced"] = datetime.utcnow()
-
-        # Store updated topic
-        await self._store_topic(session_id, topic)
-    
-    def _calculate_priority_score(self, topic: Dict[str, Any], is_correct: bool, confidence: float) -> float:
-        """Calculate new priority score based on performance"""
-        base_score = topic.get("priority_score", 1.0)
-        questions_attempted = topic.get("questions_attempted", 0)
-        questions_correct = topic.get("questions_correct", 0)
-
-        # Calculate success rate
-        success_rate = questions_correct / questions_attempted if questions_attempted > 0 else 0
+        """Apply each topic's (is_correct, confidence) outcomes as one aggregate update"""
+        # Fetch (or create) every touched topic concurrently
+        topic_names = list(outcomes_by_topic)
+        positions = np.array(await asyncio.gather(*(
+            self._get_or_create_topic(session_id, topic_name) for topic_name in topic_names
+        )), dtype=np.intp)
+        store = self._topics_by_session[session_id]
         
-        # Adjust priority based on performance
-        if is_correct:
-            # Correct answer decreases priority (less need to study)
-            if success_rate > 0.8:
-                # High success rate - significantly decrease priority
-                new_score = base_score * 0.7
-            elif success_rate > 0.6:
-                # Moderate success rate - slightly decrease priority
-                new_score = base_score * 0.9
-            else:
-                # Low success rate - maintain priority
-                new_score = base_score
-        else:
-            # Wrong answer increases priority (more need to study)
-            if success_rate < 0.3:
-                # Low success rate - significantly increase priority
-                new_score = base_score * 1.5
-            elif success_rate < 0.6:
-                # Moderate success rate - increase priority
-                new_score = base_score * 1.2
-            else:
-                # High success rate - slight increase
-                new_score = base_score * 1.1
+        # Flatten outcomes topic by topic; starts[i] is where topic i's outcomes begin
+        outcome_counts = np.array([len(outcomes_by_topic[topic_name]) for topic_name in topic_names])
+        starts = np.concatenate(([0], np.cumsum(outcome_counts)[:-1]))
+        outcomes = [outcome for topic_name in topic_names for outcome in outcomes_by_topic[topic_name]]
+        is_correct = np.array([bool(correct) for correct, _ in outcomes])
+        confidence = np.array([confidence for _, confidence in outcomes], dtype=float)
         
-        # Apply confidence adjustment
-        if confidence < 0.7:
-            # Low confidence in analysis - increase priority to be safe
-            new_score *= 1.1
+        # Update topic stats once per topic so scoring uses the batch's final success rate
+        store.questions_attempted[positions] += outcome_counts
+        store.questions_correct[positions] += np.add.reduceat(is_correct.astype(np.int64), starts)
+        store.success_rate[positions] = store.questions_correct[positions] / store.questions_attempted[positions]
         
-        # Ensure minimum priority
-        return max(new_score, 0.1)
+        # Apply each outcome to the running score in submission order, with the minimum
+        # enforced after every step; round k covers the k-th outcome of every topic at once
+        scores = store.priority_score[positions]
+        success_rates = store.success_rate[positions]
+        for k in range(outcome_counts.max()):
+            active = np.flatnonzero(outcome_counts > k)
+            current = starts[active] + k
+            scores[active] = self._calculate_priority_scores(
+                scores[active], success_rates[active], is_correct[current], confidence[current]
+            )
+        store.priority_score[positions] = scores
+        store.last_practiced[positions] = time.time()
+        
+        # Keep recommendation buckets current so reads do no math
+        store.recommendation[positions] = self._recommendation_buckets(store.success_rate[positions])
+    
+    def _calculate_priority_scores(
+        self,
+        base_scores: np.ndarray,
+        success_rates: np.ndarray,
+        is_correct: np.ndarray,
+        confidence: np.ndarray
+    ) -> np.ndarray:
+        """Calculate new priority scores for arrays of topic outcomes"""
+        return _priority_scores_ufunc(base_scores, success_rates, is_correct, confidence)
     
-    async def _get_or_create_topic(self, session_id: str, topic_name: str) -> Dict[str, Any]:
-        """Get existing topic or create new one"""
+    async def _get_or_create_topic(self, session_id: str, topic_name: str) -> int:
+        """Get the position of an existing topic or create a new one"""
         # In a real implementation, this would query the database
         # For now, we'll use a simple in-memory approach
-        topic_key = f"{session_id}_{topic_name}"
+        store = self._topics_by_session.setdefault(session_id, _SessionTopics())
         
         # Check if topic exists in our in-memory storage
-        if hasattr(self, '_topics') and topic_key in self._topics:
-            return self._topics[topic_key]
+        if topic_name in store.positions:
+            return store.positions[topic_name]
         
         # Create new topic
-        new_topic = {
-            "id": str(uuid.uuid4()),
-            "name": topic_name,
-            "priority_score": 1.0,
-            "questions_attempted": 0,
-            "questions_correct": 0,
-            "last_practiced": datetime.utcnow()
-        }
-        
-        # Store in memory
-        if not hasattr(self, '_topics'):
-            self._topics = {}
-        self._topics[topic_key] = new_topic
-        
-        return new_topic
-    
-    async def _store_topic(self, session_id: str, topic: Dict[str, Any]):
-        """Store updated topic (in real implementation, this would update database)"""
-        topic_key = f"{session_id}_{topic['name']}"
-        if not hasattr(self, '_topics'):
-            self._topics = {}
-        self._topics[topic_key] = topic
+        return store.add(topic_name)
     
     async def _rebuild_queue(self, session_id: str):
         """Rebuild the priority queue for a session"""
         # Get all topics for this session
-        session_topics = []
-        if hasattr(self, '_topics'):
-            for key, topic in self._topics.items():
-                if key.startswith(session_id):
-                    session_topics.append(topic)
+        store = self._topics_by_session.get(session_id)
+        scores = store.priority_score[:len(store)] if store is not None else np.empty(0)
         
-        # Sort by priority score (highest priority first)
-        session_topics.sort(key=lambda x: x["priority_score"], reverse=True)
-        
-        # Store sorted queue
-        self.priority_queues[session_id] = session_topics
+        # Sort by priority score (highest priority first); stable so ties keep creation order
+        self.priority_queues[session_id] = np.argsort(-scores, kind="stable")
+        self._priorities_cache.pop(session_id, None)
     
     async def get_priorities(self, session_id: str) -> List[Dict[str, Any]]:
         """Get prioritized list of topics for study focus"""
+        # Served from cache until the session's queue is rebuilt
+        if session_id in self._priorities_cache:
+            return self._priorities_cache[session_id]
+        
         if session_id not in self.priority_queues:
             await self._rebuild_queue(session_id)
         
-        priorities = self.priority_queues.get(session_id, [])
+        order = self.priority_queues[session_id]
+        store = self._topics_by_session.get(session_id)
+        priorities = []
         
-        # Add study recommendations
-        for topic in priorities:
-            topic["study_recommendation"] = self._generate_study_recommendation(topic)
+        # Materialize topic records in priority order
+        if store is not None:
+            for position, priority_score, attempted, correct, last_practiced, recommendation in zip(
+                order.tolist(),
+                store.priority_score[order].tolist(),
+                store.questions_attempted[order].tolist(),
+                store.questions_correct[order].tolist(),
+                store.last_practiced[order].tolist(),
+                store.recommendation[order].tolist(),
+            ):
+                priorities.append({
+                    "id": store.ids[position],
+                    "name": store.names[position],
+                    "priority_score": priority_score,
+                    "questions_attempted": attempted,
+                    "questions_correct": correct,
+                    "last_practiced": datetime.utcfromtimestamp(last_practiced),
+                    "study_recommendation": STUDY_RECOMMENDATIONS[recommendation]
+                })
         
+        self._priorities_cache[session_id] = priorities
         return priorities
     
-    def _generate_study_recommendation(self, topic: Dict[str, Any]) -> str:
-        """Generate study recommendation based on topic performance"""
-        success_rate = topic["questions_correct"] / topic["questions_attempted"] if topic["questions_attempted"] > 0 else 0
-        
-        if success_rate >= 0.8:
-            return "Review briefly - you're doing well!"
-        elif success_rate >= 0.6:
-            return "Practice more problems - you're on the right track"
-        elif success_rate >= 0.4:
-            return "Focus on this topic - review concepts and practice"
-        else:
-            return "High priority - review fundamentals and practice extensively"
+    def _recommendation_buckets(self, success_rates: np.ndarray) -> np.ndarray:
+        """Index into STUDY_RECOMMENDATIONS for each topic's success rate"""
+        return np.where(success_rates >= 0.8, 0, np.where(success_rates >= 0.6, 1, np.where(success_rates >= 0.4, 2, 3)))
     
     async def reset_priorities(self, session_id: str):
         """Reset all topic priorities to default values"""
-        if hasattr(self, '_topics'):
-            # Reset all topics for this session
-            for key in list(self._topics.keys()):
-                if key.startswith(session_id):
-                    topic = self._topics[key]
-                    topic["priority_score"] = 1.0
-                    topic["questions_attempted"] = 0
-                    topic["questions_correct"] = 0
-                    topic["last_practiced"] = datetime.utcnow()
+        # Reset all topics for this session
+        store = self._topics_by_session.get(session_id)
+        if store is not None:
+            count = len(store)
+            store.priority_score[:count] = 1.0
+            store.questions_attempted[:count] = 0
+            store.questions_correct[:count] = 0
+            store.last_practiced[:count] = time.time()
+            store.success_rate[:count] = 0.0
+            store.recommendation[:count] = LOWEST_RECOMMENDATION
         
         # Rebuild queue
         await self._rebuild_queue(session_id)